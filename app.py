@@ -4,46 +4,328 @@ Run with: python app.py
 Then open: http://localhost:5000
 """
 
-from flask import Flask, request, jsonify, render_template
-import json
+from flask import Flask, Response, request, jsonify, render_template
+from flask.json.provider import DefaultJSONProvider
+import functools
+import hashlib
+import orjson
 import uuid
 import os
+import queue
+import re
+import sqlite3
 import time
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+try:
+    import faiss
+except ImportError:
+    faiss = None
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 import vertexai
 from vertexai.generative_models import GenerativeModel, Tool, FunctionDeclaration, Part, GenerationConfig
+from google.api_core import exceptions as gexc
 from google.cloud import aiplatform, bigquery
 from vertexai.language_models import TextEmbeddingModel
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Serve jsonify() through orjson; Flask's default hook covers the rest."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, default=DefaultJSONProvider.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # ── Library Storage ────────────────────────────────────────────────────────────
-LIBRARY_FILE = os.path.join(os.path.dirname(__file__), "library.json")
+LIBRARY_DB   = os.path.join(os.path.dirname(__file__), "library.db")
+LIBRARY_FILE = os.path.join(os.path.dirname(__file__), "library.json")   # legacy, imported once
+
+# One shared connection in WAL mode; _LIB_LOCK serialises access to it and
+# `with _LIB_LOCK, _LIB_DB:` wraps a write in a transaction.
+_LIB_DB   = sqlite3.connect(LIBRARY_DB, check_same_thread=False)
+_LIB_DB.row_factory = sqlite3.Row
+_LIB_LOCK = threading.RLock()
+
+def _init_library():
+    with _LIB_LOCK, _LIB_DB:
+        _LIB_DB.execute("PRAGMA journal_mode=WAL")
+        _LIB_DB.execute("PRAGMA synchronous=NORMAL")
+        _LIB_DB.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                id TEXT PRIMARY KEY, name TEXT NOT NULL, created_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS papers (
+                id TEXT PRIMARY KEY, pmid TEXT NOT NULL UNIQUE, title TEXT,
+                folder_id TEXT, saved_at TEXT, notes TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS papers_folder_id ON papers(folder_id);
+        """)
+        # user_version 0 = library.json not imported yet. The import happens at
+        # most once, so deleting every paper does not resurrect the legacy ones.
+        # sqlite3 only opens a transaction implicitly at DML, so BEGIN explicitly:
+        # the version bump must roll back with the inserts if the import fails.
+        _LIB_DB.execute("BEGIN")
+        if _LIB_DB.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+        empty = not _LIB_DB.execute(
+            "SELECT EXISTS(SELECT 1 FROM folders) OR EXISTS(SELECT 1 FROM papers)"
+        ).fetchone()[0]
+        if empty and os.path.exists(LIBRARY_FILE):
+            with open(LIBRARY_FILE, "rb") as f:
+                data = orjson.loads(f.read())
+            _LIB_DB.executemany(
+                "INSERT OR IGNORE INTO folders VALUES (:id, :name, :created_at)",
+                [{"created_at": None, **f} for f in data.get("folders", [])])
+            _LIB_DB.executemany(
+                "INSERT OR IGNORE INTO papers VALUES (:id, :pmid, :title, :folder_id, :saved_at, :notes)",
+                [{"title": None, "saved_at": None, "notes": "", "folder_id": None, **p}
+                 for p in data.get("papers", [])])
+        _LIB_DB.execute("PRAGMA user_version = 1")
+
+def _lib_rows(sql, params=()):
+    with _LIB_LOCK:
+        return [dict(r) for r in _LIB_DB.execute(sql, params)]
+
+def _insert_paper(pmid, title, folder_id, saved_at):
+    """Insert a paper; returns it, or None if the PMID is already saved.
+    Caller holds _LIB_LOCK inside a transaction."""
+    paper = {
+        "id": uuid.uuid4().hex,
+        "pmid": pmid,
+        "title": title or "Untitled",
+        "folder_id": folder_id,
+        "saved_at": saved_at,
+        "notes": ""
+    }
+    cur = _LIB_DB.execute(
+        "INSERT OR IGNORE INTO papers VALUES (:id, :pmid, :title, :folder_id, :saved_at, :notes)",
+        paper)
+    return paper if cur.rowcount else None
 
-def _load_library():
-    if os.path.exists(LIBRARY_FILE):
-        with open(LIBRARY_FILE, "r") as f:
-            return json.load(f)
-    return {"folders": [], "papers": []}
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
-def _save_library(data):
-    with open(LIBRARY_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+_init_library()
 
 # ── Configuration ──────────────────────────────────────────────────────────────
 PROJECT_ID        = 'buraydah-1771991853'
 LOCATION          = 'us-central1'
 ENDPOINT_ID       = '8386487557466095616'
 DEPLOYED_INDEX_ID = 'neuro_agent_endpoint_1772132590987'
+# Skip query expansion when the original question already matches this closely
+EXPANSION_SKIP_DISTANCE = 0.8
+# Papers returned per get_valid_rag_context call
+RAG_DOC_LIMIT     = 3
+# Nearest neighbours fetched per query; a probe returning fewer distinct papers
+# than this falls through to query expansion
+ANN_NEIGHBORS     = 5
+# Read the PMID -> compound join from the pubmed_compounds_mv materialized view
+USE_PUBMED_COMPOUNDS_MV = os.environ.get("USE_PUBMED_COMPOUNDS_MV") == "1"
+# "matching_engine" (default) or "bigquery" (VECTOR_SEARCH fused with the compound join)
+VECTOR_BACKEND    = os.environ.get("VECTOR_BACKEND", "matching_engine")
 
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-aiplatform.init(project=PROJECT_ID, location=LOCATION)
+# Pin gRPC (protobuf over HTTP/2) for Vertex calls rather than relying on the
+# SDK default, which can fall back to REST in some environments.
+vertexai.init(project=PROJECT_ID, location=LOCATION, api_transport="grpc")
+aiplatform.init(project=PROJECT_ID, location=LOCATION, api_transport="grpc")
 bq_client         = bigquery.Client(project=PROJECT_ID)
-my_index_endpoint = aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
+my_index_endpoint = (aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
+                     if VECTOR_BACKEND != "bigquery" else None)
 _expansion_model  = GenerativeModel("gemini-2.5-pro")
+_embed_model      = TextEmbeddingModel.from_pretrained("text-embedding-004")
+
+# ── Embedding cache ────────────────────────────────────────────────────────────
+EMBED_CACHE_SIZE = 4096
+_embed_cache     = OrderedDict()   # query -> tuple(vector), LRU order
+_embed_lock      = threading.Lock()
+_embed_stats     = {"hits": 0, "misses": 0}
+
+def _embed_queries(queries):
+    """Embed queries, serving repeats from an in-process LRU cache.
+    All misses are sent to Vertex in a single batched call."""
+    vectors, misses = {}, []
+    with _embed_lock:
+        for q in queries:
+            if q in _embed_cache:
+                _embed_cache.move_to_end(q)
+                vectors[q] = _embed_cache[q]
+                _embed_stats["hits"] += 1
+            elif q not in misses:
+                misses.append(q)
+    if misses:
+        fresh = [tuple(e.values) for e in _embed_model.get_embeddings(misses)]
+        with _embed_lock:
+            for q, v in zip(misses, fresh):
+                vectors[q] = _embed_cache[q] = v
+                _embed_cache.move_to_end(q)
+                _embed_stats["misses"] += 1
+            while len(_embed_cache) > EMBED_CACHE_SIZE:
+                _embed_cache.popitem(last=False)
+    return [vectors[q] for q in queries]
+
+def _embed_one(q):
+    return _embed_queries([q])[0]
+
+# ── BigQuery result cache ──────────────────────────────────────────────────────
+BQ_MAX_BYTES_BILLED = int(os.environ.get("BQ_MAX_BYTES_BILLED", 50 * 1024**3))
+_BQ_CACHE = TTLCache(maxsize=2048, ttl=600)
+_BQ_LOCK  = threading.Lock()
+
+def _bq_rows(cache_key, sql, params):
+    """Run a parameterised query and return its rows as a list.
+    Results are kept for 10 minutes under cache_key (None disables caching)."""
+    if cache_key is not None:
+        with _BQ_LOCK:
+            rows = _BQ_CACHE.get(cache_key)
+        if rows is not None:
+            return rows
+    # query_and_wait uses jobs.query, which returns small result sets inline
+    # instead of creating a job and polling it for rows.
+    rows = list(bq_client.query_and_wait(sql, job_config=bigquery.QueryJobConfig(
+        query_parameters=params, use_query_cache=True,
+        maximum_bytes_billed=BQ_MAX_BYTES_BILLED,
+    )))
+    if cache_key is not None:
+        with _BQ_LOCK:
+            _BQ_CACHE[cache_key] = rows
+    return rows
+
+# ── Persistent cache ───────────────────────────────────────────────────────────
+# sqlite key/value store for results worth keeping across restarts (the eval
+# suite asks the same 30 questions on every run). Keys are SHA-1 of the text.
+DISK_CACHE_FILE = os.path.join(os.path.dirname(__file__), "cache.sqlite")
+
+def _disk_cache():
+    db = sqlite3.connect(DISK_CACHE_FILE, timeout=5)
+    db.execute("CREATE TABLE IF NOT EXISTS cache ("
+               "ns TEXT, key TEXT, value TEXT, created_at REAL, PRIMARY KEY (ns, key))")
+    return db
+
+def _disk_cache_get(ns, text, ttl=None):
+    key = hashlib.sha1(text.encode()).hexdigest()
+    try:
+        with closing(_disk_cache()) as db:
+            row = db.execute("SELECT value, created_at FROM cache WHERE ns = ? AND key = ?",
+                             (ns, key)).fetchone()
+    except sqlite3.Error as e:
+        print(f"[cache] {ns} read failed: {e}")
+        return None
+    if row is None or (ttl is not None and time.time() - row[1] > ttl):
+        return None
+    return orjson.loads(row[0])
+
+def _disk_cache_put(ns, text, value):
+    key = hashlib.sha1(text.encode()).hexdigest()
+    try:
+        with closing(_disk_cache()) as db, db:
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                       (ns, key, app.json.dumps(value), time.time()))
+    except sqlite3.Error as e:
+        print(f"[cache] {ns} write failed: {e}")
+
+# ── Semantic answer cache ──────────────────────────────────────────────────────
+class SemanticCache:
+    """FIFO cache of agent answers keyed by question embedding.
+    Lookups use a FAISS inner-product index when faiss is installed
+    (pip install faiss-cpu), otherwise one numpy matrix-vector product."""
+
+    def __init__(self, capacity=1000, threshold=0.95):
+        self.capacity  = capacity
+        self.threshold = threshold
+        self._matrix   = None          # (capacity, dim) L2-normalised rows, numpy path
+        self._index    = None          # faiss.IndexIDMap2 keyed by slot, faiss path
+        self._values   = [None] * capacity
+        self._size     = 0
+        self._next     = 0
+        self._lock     = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+
+    @staticmethod
+    def _normalise(vec):
+        v = np.asarray(vec, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def _best(self, qv):
+        if self._index is not None:
+            scores, slots = self._index.search(qv.reshape(1, -1), 1)
+            return int(slots[0, 0]), float(scores[0, 0])
+        scores = self._matrix[:self._size] @ qv
+        best   = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def get(self, vec):
+        qv = self._normalise(vec)
+        with self._lock:
+            if self._size:
+                best, score = self._best(qv)
+                if best >= 0 and score >= self.threshold:
+                    self.hits += 1
+                    return self._values[best]
+            self.misses += 1
+            return None
+
+    def put(self, vec, value):
+        qv = self._normalise(vec)
+        with self._lock:
+            slot = self._next
+            if faiss is not None:
+                if self._index is None:
+                    self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(qv.shape[0]))
+                ids = np.array([slot], dtype=np.int64)
+                if self._size == self.capacity:
+                    self._index.remove_ids(ids)
+                self._index.add_with_ids(qv.reshape(1, -1), ids)
+            else:
+                if self._matrix is None:
+                    self._matrix = np.zeros((self.capacity, qv.shape[0]), dtype=np.float32)
+                self._matrix[slot] = qv
+            self._values[slot] = value
+            self._next = (slot + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": self._size, "capacity": self.capacity,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+_answer_cache = SemanticCache()
 
 # ── Agent logic (same as notebook) ────────────────────────────────────────────
-def expand_query(question):
+# Rate limits and timeouts are worth retrying; anything else fails fast.
+_TRANSIENT_ERRORS = (gexc.ResourceExhausted, gexc.DeadlineExceeded, gexc.ServiceUnavailable)
+
+@retry(retry=retry_if_exception_type(_TRANSIENT_ERRORS), stop=stop_after_attempt(3),
+       wait=wait_exponential(multiplier=0.5, max=4), reraise=True)
+def _generate_expansions(prompt):
+    return _expansion_model.generate_content(
+        prompt, generation_config=GenerationConfig(temperature=0.2)
+    )
+
+@functools.lru_cache(maxsize=1024)
+def _expansions(question):
+    """Up to 3 Gemini rewrites of question, memoised in memory and on disk.
+    Raises on failure, so failed expansions are never cached."""
+    cached = _disk_cache_get("expansions", question)
+    if cached is not None:
+        return tuple(cached)
     prompt = f"""You are a biomedical search expert.
 Rewrite this research question into 3 alternative versions using:
 - Technical/scientific terminology (MeSH terms, gene names, pathway names)
@@ -52,55 +334,225 @@ Rewrite this research question into 3 alternative versions using:
 Return ONLY a JSON array of 3 strings. No explanation, no markdown.
 Question: "{question}"
 Example: ["technical version 1", "technical version 2", "technical version 3"]"""
+    response = _generate_expansions(prompt)
+    text = response.text.strip().replace("```json","").replace("```","").strip()
+    expansions = orjson.loads(text)
+    if not isinstance(expansions, list):
+        raise ValueError("expansion is not a JSON array")
+    expansions = tuple(e for e in expansions[:3] if isinstance(e, str))
+    _disk_cache_put("expansions", question, expansions)
+    return expansions
+
+def expand_query(question):
     try:
-        response = _expansion_model.generate_content(
-            prompt, generation_config=GenerationConfig(temperature=0.2)
-        )
-        text = response.text.strip().replace("```json","").replace("```","").strip()
-        expansions = json.loads(text)
-        return [question] + expansions[:3]
-    except:
+        expansions = _expansions(question)
+    except ValueError as e:   # blocked response or malformed JSON (orjson.JSONDecodeError)
+        print(f"[expand_query] unusable expansion: {e}")
         return [question]
+    except gexc.GoogleAPIError as e:
+        print(f"[expand_query] expansion failed: {e}")
+        return [question]
+    # Gemini often echoes the question or repeats a rewrite; drop those so
+    # every query sent to embedding + ANN is distinct.
+    queries, seen = [], set()
+    for q in [question, *expansions]:
+        key = " ".join(q.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            queries.append(q)
+    return queries
 
-def get_valid_rag_context(question):
-    embed_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-    all_queries = expand_query(question)
-    seen_ids = {}
-    for q in all_queries:
-        try:
-            qv = embed_model.get_embeddings([q])[0].values
-            resp = my_index_endpoint.find_neighbors(
-                deployed_index_id=DEPLOYED_INDEX_ID, queries=[qv], num_neighbors=5
+def _merge_neighbors(ids, dists, k):
+    """Per-id minimum distance across all query results, vectorised.
+    Returns (up to k ids ordered by distance, best distance)."""
+    order = np.argsort(ids, kind="stable")
+    ids_s, dists_s = ids[order], dists[order]
+    uniq_ids, start = np.unique(ids_s, return_index=True)
+    mins = np.minimum.reduceat(dists_s, start)
+    top = np.argpartition(mins, k)[:k] if len(mins) > k else np.arange(len(mins))
+    top = top[np.argsort(mins[top], kind="stable")]
+    return uniq_ids[top].tolist(), float(mins[top[0]])
+
+_PMID_JOIN_SQL = """
+    SELECT m.pmid, m.title, SUBSTR(m.article_text, 1, 15000) AS article_text,
+           c.drug_name, c.potency_ic50, c.standard_units, c.protein_target
+    FROM `buraydah-1771991853.neuro_rag.pubmed_neuro_master` AS m
+    LEFT JOIN `buraydah-1771991853.neuro_rag.neurology_compounds_master` AS c
+        ON m.pmid = c.pubmed_id
+    WHERE m.pmid IN UNNEST(@ids) LIMIT @doc_limit
+"""
+
+# Same rows read from a precomputed join (excerpt already truncated):
+#   CREATE MATERIALIZED VIEW `buraydah-1771991853.neuro_rag.pubmed_compounds_mv`
+#   CLUSTER BY pmid
+#   OPTIONS (enable_refresh = true, max_staleness = INTERVAL "4" HOUR,
+#            allow_non_incremental_definition = true)
+#   AS SELECT m.pmid, m.title, SUBSTR(m.article_text, 1, 15000) AS article_text,
+#             c.drug_name, c.potency_ic50, c.standard_units, c.protein_target
+#      FROM `buraydah-1771991853.neuro_rag.pubmed_neuro_master` AS m
+#      LEFT JOIN `buraydah-1771991853.neuro_rag.neurology_compounds_master` AS c
+#          ON m.pmid = c.pubmed_id
+_PMID_JOIN_MV_SQL = """
+    SELECT pmid, title, article_text, drug_name, potency_ic50, standard_units, protein_target
+    FROM `buraydah-1771991853.neuro_rag.pubmed_compounds_mv`
+    WHERE pmid IN UNNEST(@ids) LIMIT @doc_limit
+"""
+
+def _find_neighbors(qvs):
+    """Batched Matching Engine ANN lookup -> [(pmid, distance), ...] across all
+    query vectors; [] on no neighbours."""
+    resp = []
+    # One batched ANN call for all expansions instead of a round-trip per query.
+    try:
+        resp = my_index_endpoint.find_neighbors(
+            deployed_index_id=DEPLOYED_INDEX_ID, queries=qvs, num_neighbors=ANN_NEIGHBORS
+        ) or []
+    except _TRANSIENT_ERRORS:
+        raise
+    except gexc.GoogleAPIError as e:
+        print(f"[retrieval] find_neighbors failed: {e}")
+    return [(n.id, n.distance) for neighbors in resp for n in neighbors or []
+            if n.id not in ['0','null',None,'']]
+
+def _pmid_join(top_ids):
+    """BigQuery join of paper text and compounds for the given PMIDs."""
+    sql = _PMID_JOIN_MV_SQL if USE_PUBMED_COMPOUNDS_MV else _PMID_JOIN_SQL
+    return _bq_rows(("pmid_join", tuple(sorted(top_ids))), sql,
+                    [bigquery.ArrayQueryParameter("ids","STRING",top_ids),
+                     bigquery.ScalarQueryParameter("doc_limit","INT64",RAG_DOC_LIMIT)])
+
+def _search_bq_vector(qvs):
+    """Retrieval and compound join fused into one BigQuery VECTOR_SEARCH job.
+    Needs an `embedding` ARRAY<FLOAT64> column on pubmed_neuro_master, e.g.
+    CREATE VECTOR INDEX pubmed_embedding_idx ON neuro_rag.pubmed_neuro_master(embedding)
+    OPTIONS (index_type = 'IVF').
+    Returns (best_distance, rows, distinct neighbour count); best_distance is
+    None on no neighbours."""
+    sql = f"""
+        WITH hits AS (
+            SELECT base.pmid AS pmid, MIN(distance) AS distance,
+                   COUNT(*) OVER () AS n_hits
+            FROM VECTOR_SEARCH(
+                TABLE `buraydah-1771991853.neuro_rag.pubmed_neuro_master`, 'embedding',
+                (SELECT qid, embedding FROM UNNEST(@qvs)),
+                query_column_to_search => 'embedding', top_k => {ANN_NEIGHBORS}
             )
-            if resp and resp[0]:
-                for n in resp[0]:
-                    if n.id not in ['0','null',None,'']:
-                        if n.id not in seen_ids or n.distance < seen_ids[n.id]:
-                            seen_ids[n.id] = n.distance
-        except: pass
-    if not seen_ids:
-        return {"error": "No results found."}
-    top_ids    = [k for k,_ in sorted(seen_ids.items(), key=lambda x:x[1])][:5]
-    best_score = min(seen_ids.values())
-    low_conf   = best_score > 1.2
-    sql = """
-        SELECT m.pmid, m.title, m.article_text, c.drug_name, c.potency_ic50,
-               c.standard_units, c.protein_target
-        FROM `buraydah-1771991853.neuro_rag.pubmed_neuro_master` AS m
+            GROUP BY pmid
+            ORDER BY distance LIMIT {ANN_NEIGHBORS}
+        )
+        SELECT m.pmid, m.title, SUBSTR(m.article_text, 1, 15000) AS article_text,
+               c.drug_name, c.potency_ic50, c.standard_units, c.protein_target, h.distance,
+               h.n_hits
+        FROM hits AS h
+        JOIN `buraydah-1771991853.neuro_rag.pubmed_neuro_master` AS m
+            ON m.pmid = h.pmid
         LEFT JOIN `buraydah-1771991853.neuro_rag.neurology_compounds_master` AS c
             ON m.pmid = c.pubmed_id
-        WHERE m.pmid IN UNNEST(@ids) LIMIT 3
+        ORDER BY h.distance LIMIT @doc_limit
     """
-    df = bq_client.query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ArrayQueryParameter("ids","STRING",top_ids)]
-    )).to_dataframe()
-    if df.empty:
+    qvs_param = bigquery.ArrayQueryParameter("qvs", "STRUCT", [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("qid", "INT64", i),
+            bigquery.ArrayQueryParameter("embedding", "FLOAT64", qv),
+        )
+        for i, qv in enumerate(qvs)
+    ])
+    rows = _bq_rows(None, sql, [qvs_param,
+                                bigquery.ScalarQueryParameter("doc_limit","INT64",RAG_DOC_LIMIT)])
+    if not rows:
+        return None, None, 0
+    return min(r["distance"] for r in rows), rows, rows[0]["n_hits"]
+
+def _embed_for_search(queries):
+    """Query vectors for retrieval, or None if embedding failed."""
+    try:
+        return [list(v) for v in _embed_queries(queries)]
+    except _TRANSIENT_ERRORS:
+        raise
+    except gexc.GoogleAPIError as e:
+        print(f"[retrieval] embedding failed: {e}")
+        return None
+
+def _needs_expansion(best_score, n_neighbors):
+    return (best_score is None or best_score > EXPANSION_SKIP_DISTANCE
+            or n_neighbors < ANN_NEIGHBORS)
+
+def _expansion_queries(question):
+    """Gemini rewrites of the question, without the question itself."""
+    return expand_query(question)[1:]
+
+def _retrieve_matching_engine(question):
+    """Probe ANN with the question, add the expansions' neighbours only if the
+    probe is weak, then run the BigQuery join once on the merged top PMIDs."""
+    qvs  = _embed_for_search([question])
+    hits = _find_neighbors(qvs) if qvs else []
+    if _needs_expansion(min((d for _, d in hits), default=None),
+                        len({pmid for pmid, _ in hits})):
+        extra = _expansion_queries(question)
+        try:
+            extra_qvs = _embed_for_search(extra) if extra else None
+            if extra_qvs:
+                hits += _find_neighbors(extra_qvs)
+        except _TRANSIENT_ERRORS as e:
+            print(f"[retrieval] expanded search skipped: {e}")
+    if not hits:
+        return None, None
+    ids, dists = zip(*hits)
+    top_ids, best_score = _merge_neighbors(np.array(ids), np.array(dists, dtype=np.float64), ANN_NEIGHBORS)
+    return best_score, _pmid_join(top_ids)
+
+def _retrieve_bq_vector(question):
+    """VECTOR_SEARCH fuses ANN and the join into one job, so a weak probe is
+    followed by a second job over the question and its expansions."""
+    qvs = _embed_for_search([question])
+    best_score, rows, n_neighbors = _search_bq_vector(qvs) if qvs else (None, None, 0)
+    if _needs_expansion(best_score, n_neighbors):
+        extra = _expansion_queries(question)
+        try:
+            all_qvs = _embed_for_search([question, *extra]) if extra else None
+            if all_qvs:
+                expanded = _search_bq_vector(all_qvs)
+                if expanded[0] is not None:
+                    best_score, rows, _ = expanded
+        except _TRANSIENT_ERRORS as e:
+            print(f"[retrieval] expanded search skipped: {e}")
+    return best_score, rows
+
+_RAG_CACHE = TTLCache(maxsize=1024, ttl=600)
+_RAG_LOCK  = threading.Lock()
+
+def get_valid_rag_context(question):
+    with _RAG_LOCK:
+        cached = _RAG_CACHE.get(question)
+    if cached is not None:
+        return cached
+    result = _get_valid_rag_context(question)
+    if "error" not in result:
+        with _RAG_LOCK:
+            _RAG_CACHE[question] = result
+    return result
+
+def _get_valid_rag_context(question):
+    # Probe with the original question first; only pay for the Gemini query
+    # expansion and the extra lookups when the best match is weak or the probe
+    # returned fewer than ANN_NEIGHBORS distinct papers. A rate limit or timeout
+    # on the probe stops retrieval rather than issuing more doomed requests.
+    retrieve = _retrieve_bq_vector if VECTOR_BACKEND == "bigquery" else _retrieve_matching_engine
+    try:
+        best_score, rows = retrieve(question)
+    except _TRANSIENT_ERRORS as e:
+        return {"error": f"Retrieval temporarily unavailable: {e}", "transient": True}
+    if best_score is None:
+        return {"error": "No results found."}
+    low_conf = best_score > 1.2
+    if not rows:
         return {"error": "No records found."}
     docs = []
-    for _, row in df.iterrows():
+    for row in rows:
         docs.append({
             "pmid": row["pmid"], "title": str(row["title"] or "Unknown"),
-            "article_excerpt": str(row["article_text"])[:15000],
+            "article_excerpt": row["article_text"] or "",
             "drug_name": row["drug_name"], "potency_ic50": row["potency_ic50"],
             "standard_units": row["standard_units"], "protein_target": row["protein_target"],
         })
@@ -113,20 +565,28 @@ def get_valid_rag_context(question):
         )
     }
 
+_CHEMBL_SQL = """
+    SELECT drug_name, protein_target, uniprot_id, pubmed_id, potency_ic50, standard_units
+    FROM `buraydah-1771991853.neuro_rag.neurology_compounds_master`
+    WHERE {predicate} ORDER BY drug_name ASC LIMIT 10
+"""
+
 def search_chembl_drugs(drug_name):
-    sql = """
-        SELECT drug_name, protein_target, uniprot_id, pubmed_id, potency_ic50, standard_units
-        FROM `buraydah-1771991853.neuro_rag.neurology_compounds_master`
-        WHERE UPPER(drug_name) LIKE @drug ORDER BY drug_name ASC LIMIT 10
-    """
+    # Fast path: SEARCH() matches whole (case-insensitive) tokens and is served
+    # by the drug_name search index, see README "BigQuery Setup". Only partial
+    # names ("donep") fall through to the CONTAINS_SUBSTR substring scan.
+    drug   = drug_name.strip().lower()
+    phrase = "`" + drug.replace("\\", "").replace("`", "") + "`"
     try:
-        df = bq_client.query(sql, job_config=bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ScalarQueryParameter("drug","STRING",f"%{drug_name.upper()}%")]
-        )).to_dataframe()
-        if df.empty: return {"error": f"No entries found for '{drug_name}'."}
-        return {"results": df.to_dict(orient="records")}
+        rows = _bq_rows(("chembl_search", drug), _CHEMBL_SQL.format(predicate="SEARCH(drug_name, @drug)"),
+                        [bigquery.ScalarQueryParameter("drug","STRING",phrase)])
+        if not rows:
+            rows = _bq_rows(("chembl", drug), _CHEMBL_SQL.format(predicate="CONTAINS_SUBSTR(drug_name, @drug)"),
+                            [bigquery.ScalarQueryParameter("drug","STRING",drug)])
+        if not rows: return {"error": f"No entries found for '{drug_name}'."}
+        return {"results": [dict(r.items()) for r in rows]}
     except Exception as e:
-        return {"error": str(e)}
+        return {"error": str(e), "transient": True}
 
 TOOL_REGISTRY = {
     "get_valid_rag_context": get_valid_rag_context,
@@ -146,17 +606,43 @@ neuro_tools = Tool(function_declarations=[
     ),
 ])
 
+_SYSTEM_INSTRUCTION = (
+    "You are a neuroscience research assistant. Answer by calling tools to retrieve real data. "
+    "Call multiple tools in sequence. Synthesize ALL documents returned and cite each PMID. "
+    "If low_confidence is true or documents don't address the question, say you don't have "
+    "sufficient evidence and suggest resources. Never fabricate. Always cite PMIDs."
+)
+_AGENT_MODEL = GenerativeModel(
+    model_name="gemini-2.5-pro", tools=[neuro_tools], system_instruction=_SYSTEM_INSTRUCTION
+)
+
+_IDK_RE = re.compile(
+    r"don't have sufficient|insufficient evidence|cannot find|i don't know", re.IGNORECASE
+)
+
+def _call_tool(fn_name, fn_args):
+    if fn_name not in TOOL_REGISTRY:
+        return {"error": f"Unknown tool: {fn_name}"}
+    # A failing tool is reported back to the model instead of aborting the
+    # whole hop (and discarding the results of calls that ran alongside it).
+    # "transient" marks errors from exceptions (as opposed to an empty lookup),
+    # so answers built on them are not cached.
+    try:
+        return TOOL_REGISTRY[fn_name](**fn_args)
+    except Exception as e:
+        return {"error": str(e), "transient": True}
+
+MAX_HOPS_ANSWER = "Agent reached max hops."
+
+def _cacheable(result):
+    """False for answers that should not be replayed from a cache: the max-hops
+    fallback, or any run where a tool call failed with an exception."""
+    if result.get("answer") == MAX_HOPS_ANSWER:
+        return False
+    return not any(t.get("transient") for t in result.get("trace", []))
+
 def run_neuro_agent(user_query, progress_callback=None):
-    model = GenerativeModel(
-        model_name="gemini-2.5-pro", tools=[neuro_tools],
-        system_instruction=(
-            "You are a neuroscience research assistant. Answer by calling tools to retrieve real data. "
-            "Call multiple tools in sequence. Synthesize ALL documents returned and cite each PMID. "
-            "If low_confidence is true or documents don't address the question, say you don't have "
-            "sufficient evidence and suggest resources. Never fabricate. Always cite PMIDs."
-        )
-    )
-    chat    = model.start_chat()
+    chat    = _AGENT_MODEL.start_chat()
     message = user_query
     hops    = 0
     trace   = []
@@ -166,19 +652,20 @@ def run_neuro_agent(user_query, progress_callback=None):
         response  = chat.send_message(message)
         candidate = response.candidates[0]
 
-        tool_calls = [
-            p for p in candidate.content.parts
-            if hasattr(p,'function_call') and p.function_call is not None
-            and p.function_call.name and p.function_call.name != ""
-        ]
+        # Single pass: split parts into tool calls and answer text.
+        tool_calls, text_parts = [], []
+        for p in candidate.content.parts:
+            fc = getattr(p, 'function_call', None)
+            if fc is not None and fc.name:
+                tool_calls.append(p)
+            else:
+                t = getattr(p, 'text', None)
+                if t:
+                    text_parts.append(t)
 
         if not tool_calls:
-            final_text = "".join(
-                p.text for p in candidate.content.parts
-                if hasattr(p,'text') and p.text
-            )
-            idk = any(x in final_text.lower() for x in
-                      ["don't have sufficient","insufficient evidence","cannot find","i don't know"])
+            final_text = "".join(text_parts)
+            idk = bool(_IDK_RE.search(final_text))
             return {
                 "answer":     final_text,
                 "hops":       hops,
@@ -187,18 +674,22 @@ def run_neuro_agent(user_query, progress_callback=None):
                 "cited_papers": list(cited_papers.values())
             }
 
+        # Gemini may emit several independent calls per turn; run them concurrently
+        # (each is an I/O-bound BigQuery / Matching Engine RPC) and keep the order.
+        calls = [(p.function_call.name, dict(p.function_call.args)) for p in tool_calls]
+        with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+            results = list(ex.map(lambda c: _call_tool(*c), calls))
+
         tool_results = []
-        for p in tool_calls:
-            fn_name = p.function_call.name
-            fn_args = dict(p.function_call.args)
-            result  = TOOL_REGISTRY[fn_name](**fn_args) if fn_name in TOOL_REGISTRY \
-                      else {"error": f"Unknown tool: {fn_name}"}
+        for (fn_name, fn_args), result in zip(calls, results):
             if fn_name == "get_valid_rag_context" and "documents" in result:
                 for doc in result["documents"]:
                     pmid = doc.get("pmid")
                     if pmid and pmid not in cited_papers:
                         cited_papers[pmid] = {"pmid": pmid, "title": doc.get("title", "Untitled")}
             trace.append({"hop": hops+1, "tool": fn_name, "args": fn_args, "result_summary": _summarise(fn_name, result)})
+            if result.get("transient"):
+                trace[-1]["transient"] = True
             if progress_callback:
                 progress_callback(hops+1, fn_name, fn_args)
             tool_results.append(Part.from_function_response(name=fn_name, response=result))
@@ -206,7 +697,7 @@ def run_neuro_agent(user_query, progress_callback=None):
         message = tool_results
         hops   += 1
 
-    return {"answer": "Agent reached max hops.", "hops": hops, "low_confidence": True, "trace": trace, "cited_papers": list(cited_papers.values())}
+    return {"answer": MAX_HOPS_ANSWER, "hops": hops, "low_confidence": True, "trace": trace, "cited_papers": list(cited_papers.values())}
 
 def _summarise(fn_name, result):
     if "error" in result:
@@ -225,6 +716,52 @@ def _summarise(fn_name, result):
 def index():
     return render_template("index.html")
 
+def _answer_query(q, progress_callback=None):
+    # The answer cache is an optimisation: if the query can't be embedded,
+    # answer it uncached rather than failing the request.
+    try:
+        qv     = _embed_one(q)
+        cached = _answer_cache.get(qv)
+    except gexc.GoogleAPIError as e:
+        print(f"[cache] answer cache bypassed: {e}")
+        qv, cached = None, None
+    if cached is not None:
+        return {**cached, "cache_hit": True}
+    result = run_neuro_agent(q, progress_callback=progress_callback)
+    if qv is not None and _cacheable(result):
+        _answer_cache.put(qv, result)
+    return {**result, "cache_hit": False}
+
+SSE_HEARTBEAT_SECONDS = 15
+
+def _sse_stream(q):
+    """Run the agent on a worker thread and yield one SSE message per tool
+    call, followed by a final "result" (or "error") message."""
+    events = queue.Queue()
+
+    def on_hop(hop, fn_name, fn_args):
+        events.put({"type": "hop", "hop": hop, "tool": fn_name, "args": fn_args})
+
+    def worker():
+        try:
+            events.put({"type": "result", **_answer_query(q, progress_callback=on_hop)})
+        except Exception as e:
+            events.put({"type": "error", "error": str(e)})
+
+    threading.Thread(target=worker, daemon=True).start()
+    yield ": started\n\n"   # flush headers so the client sees the stream open at once
+    while True:
+        try:
+            event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+        except queue.Empty:
+            # Comment line: ignored by EventSource, keeps proxies from
+            # closing the connection during a long Gemini turn.
+            yield ": keep-alive\n\n"
+            continue
+        yield f"data: {app.json.dumps(event)}\n\n"
+        if event["type"] != "hop":
+            return
+
 @app.route("/query", methods=["POST"])
 def query():
     data  = request.json
@@ -232,15 +769,43 @@ def query():
     if not q:
         return jsonify({"error": "No question provided"}), 400
     try:
-        result = run_neuro_agent(q)
-        return jsonify(result)
+        return jsonify(_answer_query(q))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/query/stream", methods=["GET"])
+def query_stream():
+    q = request.args.get("question", "").strip()
+    if not q:
+        return jsonify({"error": "No question provided"}), 400
+    return Response(_sse_stream(q), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    with _embed_lock:
+        hits, misses = _embed_stats["hits"], _embed_stats["misses"]
+        size = len(_embed_cache)
+    total = hits + misses
+    return jsonify({
+        "embeddings": {
+            "size": size, "capacity": EMBED_CACHE_SIZE,
+            "hits": hits, "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        },
+        "answers": _answer_cache.stats(),
+        "bigquery": {"size": len(_BQ_CACHE), "capacity": _BQ_CACHE.maxsize},
+        "rag_context": {"size": len(_RAG_CACHE), "capacity": _RAG_CACHE.maxsize},
+        "expansions": _expansions.cache_info()._asdict(),
+    })
+
 # ── Library API ────────────────────────────────────────────────────────────────
 @app.route("/library", methods=["GET"])
 def get_library():
-    return jsonify(_load_library())
+    return jsonify({
+        "folders": _lib_rows("SELECT * FROM folders ORDER BY rowid"),
+        "papers":  _lib_rows("SELECT * FROM papers ORDER BY rowid"),
+    })
 
 @app.route("/library/folders", methods=["POST"])
 def create_folder():
@@ -248,37 +813,32 @@ def create_folder():
     name = data.get("name", "").strip()
     if not name:
         return jsonify({"error": "Folder name required"}), 400
-    lib = _load_library()
     folder = {
-        "id": str(uuid.uuid4()),
+        "id": uuid.uuid4().hex,
         "name": name,
-        "created_at": datetime.utcnow().isoformat()
+        "created_at": _now()
     }
-    lib["folders"].append(folder)
-    _save_library(lib)
+    with _LIB_LOCK, _LIB_DB:
+        _LIB_DB.execute("INSERT INTO folders VALUES (:id, :name, :created_at)", folder)
     return jsonify(folder), 201
 
 @app.route("/library/folders/<folder_id>", methods=["DELETE"])
 def delete_folder(folder_id):
-    lib = _load_library()
-    lib["folders"] = [f for f in lib["folders"] if f["id"] != folder_id]
-    for paper in lib["papers"]:
-        if paper.get("folder_id") == folder_id:
-            paper["folder_id"] = None
-    _save_library(lib)
+    with _LIB_LOCK, _LIB_DB:
+        _LIB_DB.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+        _LIB_DB.execute("UPDATE papers SET folder_id = NULL WHERE folder_id = ?", (folder_id,))
     return jsonify({"success": True})
 
 @app.route("/library/folders/<folder_id>", methods=["PATCH"])
 def update_folder(folder_id):
     data = request.json
-    lib = _load_library()
-    for folder in lib["folders"]:
-        if folder["id"] == folder_id:
-            if "name" in data:
-                folder["name"] = data["name"]
-            _save_library(lib)
-            return jsonify(folder)
-    return jsonify({"error": "Folder not found"}), 404
+    with _LIB_LOCK, _LIB_DB:
+        if "name" in data:
+            _LIB_DB.execute("UPDATE folders SET name = ? WHERE id = ?", (data["name"], folder_id))
+        rows = _lib_rows("SELECT * FROM folders WHERE id = ?", (folder_id,))
+    if not rows:
+        return jsonify({"error": "Folder not found"}), 404
+    return jsonify(rows[0])
 
 @app.route("/library/papers", methods=["POST"])
 def save_paper():
@@ -287,42 +847,49 @@ def save_paper():
     title = data.get("title", "").strip()
     if not pmid:
         return jsonify({"error": "PMID required"}), 400
-    lib = _load_library()
-    for p in lib["papers"]:
-        if p["pmid"] == pmid:
-            return jsonify({"error": "Paper already in library"}), 409
-    paper = {
-        "id": str(uuid.uuid4()),
-        "pmid": pmid,
-        "title": title or "Untitled",
-        "folder_id": data.get("folder_id"),
-        "saved_at": datetime.utcnow().isoformat(),
-        "notes": ""
-    }
-    lib["papers"].append(paper)
-    _save_library(lib)
+    with _LIB_LOCK, _LIB_DB:
+        paper = _insert_paper(pmid, title, data.get("folder_id"), _now())
+    if paper is None:
+        return jsonify({"error": "Paper already in library"}), 409
     return jsonify(paper), 201
 
+@app.route("/library/papers/bulk", methods=["POST"])
+def save_papers_bulk():
+    """Save many papers in a single transaction.
+    Body: {"papers": [{"pmid", "title", "folder_id"}, ...]}; PMIDs already in
+    the library (or repeated in the batch) are reported as skipped."""
+    items = (request.json or {}).get("papers", [])
+    saved, skipped = [], []
+    saved_at = _now()
+    with _LIB_LOCK, _LIB_DB:
+        for item in items:
+            pmid = str(item.get("pmid", "")).strip()
+            paper = pmid and _insert_paper(pmid, str(item.get("title", "")).strip(),
+                                           item.get("folder_id"), saved_at)
+            if paper:
+                saved.append(paper)
+            else:
+                skipped.append(pmid)
+    return jsonify({"saved": saved, "skipped": skipped}), 201
+
 @app.route("/library/papers/<paper_id>", methods=["DELETE"])
 def delete_paper(paper_id):
-    lib = _load_library()
-    lib["papers"] = [p for p in lib["papers"] if p["id"] != paper_id]
-    _save_library(lib)
+    with _LIB_LOCK, _LIB_DB:
+        _LIB_DB.execute("DELETE FROM papers WHERE id = ?", (paper_id,))
     return jsonify({"success": True})
 
 @app.route("/library/papers/<paper_id>", methods=["PATCH"])
 def update_paper(paper_id):
     data = request.json
-    lib = _load_library()
-    for paper in lib["papers"]:
-        if paper["id"] == paper_id:
-            if "folder_id" in data:
-                paper["folder_id"] = data["folder_id"]
-            if "notes" in data:
-                paper["notes"] = data["notes"]
-            _save_library(lib)
-            return jsonify(paper)
-    return jsonify({"error": "Paper not found"}), 404
+    with _LIB_LOCK, _LIB_DB:
+        if "folder_id" in data:
+            _LIB_DB.execute("UPDATE papers SET folder_id = ? WHERE id = ?", (data["folder_id"], paper_id))
+        if "notes" in data:
+            _LIB_DB.execute("UPDATE papers SET notes = ? WHERE id = ?", (data["notes"], paper_id))
+        rows = _lib_rows("SELECT * FROM papers WHERE id = ?", (paper_id,))
+    if not rows:
+        return jsonify({"error": "Paper not found"}), 404
+    return jsonify(rows[0])
 
 
 # ── 30 Evaluation Questions ────────────────────────────────────────────────────
@@ -405,10 +972,27 @@ EVAL_QUESTIONS = {
     ]
 }
 
+@functools.lru_cache(maxsize=None)
+def _concept_matcher(concepts: tuple) -> tuple:
+    """(pattern, lower-cased concepts) for a concept list.
+    The lookahead reports overlapping concepts ("inflammation" inside
+    "neuroinflammation"); alternatives are tried longest first."""
+    alts = "|".join(re.escape(c) for c in sorted(concepts, key=len, reverse=True))
+    return re.compile(f"(?=({alts}))", re.IGNORECASE), tuple(c.lower() for c in concepts)
+
+# Build every eval question's matcher once, at import.
+for _questions in EVAL_QUESTIONS.values():
+    for _q in _questions:
+        _concept_matcher(tuple(_q["expected_concepts"]))
+
 def _score_answer(answer: str, expected_concepts: list) -> dict:
-    answer_lower = answer.lower()
-    hits   = [c for c in expected_concepts if c.lower() in answer_lower]
-    missed = [c for c in expected_concepts if c.lower() not in answer_lower]
+    # One regex pass over the answer; a concept that is a prefix of a longer
+    # match at the same position still counts as found.
+    pattern, lowered = _concept_matcher(tuple(expected_concepts))
+    found = {m.lower() for m in pattern.findall(answer)}
+    hits, missed = [], []
+    for c, cl in zip(expected_concepts, lowered):
+        (hits if any(cl in f for f in found) else missed).append(c)
     coverage = len(hits) / len(expected_concepts) if expected_concepts else 0
     return {
         "hits":     hits,
@@ -422,53 +1006,105 @@ def get_eval_questions():
     """Return all 30 evaluation questions"""
     return jsonify(EVAL_QUESTIONS)
 
+class _RateLimiter:
+    """Token bucket: up to `burst` calls start at once, then `rate` per second."""
+
+    def __init__(self, rate, burst):
+        self.rate     = rate
+        self.burst    = burst
+        self._lock    = threading.Lock()
+        self._tokens  = float(burst)
+        self._updated = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now (possibly going negative) so later callers
+            # queue behind this one instead of racing for the same refill.
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        time.sleep(delay)
+
+AGENT_CACHE_TTL = 24 * 3600   # eval answers are reused for a day
+
+def _cached_agent_run(question, fresh=False, limiter=None):
+    """run_neuro_agent for the fixed eval questions, cached on disk.
+    fresh=True forces a new run (and refreshes the cache); only real agent
+    runs wait on the rate limiter."""
+    result = None if fresh else _disk_cache_get("agent", question, ttl=AGENT_CACHE_TTL)
+    if result is None:
+        if limiter is not None:
+            limiter.wait()
+        result = run_neuro_agent(question)
+        if _cacheable(result):
+            _disk_cache_put("agent", question, result)
+    return result
+
+def _eval_row(category, q, fresh=False, limiter=None):
+    try:
+        result = _cached_agent_run(q["question"], fresh, limiter)
+        answer = result.get("answer", "")
+        score = _score_answer(answer, q["expected_concepts"])
+        return {
+            "id": q["id"],
+            "category": category,
+            "question": q["question"],
+            "pass": score["pass"],
+            "coverage": f"{score['coverage']*100:.0f}%",
+            "hits": score["hits"],
+            "missed": score["missed"],
+            "gap": q.get("gap", ""),
+            "answer_preview": answer[:500] if answer else ""
+        }
+    except Exception as e:
+        return {
+            "id": q["id"],
+            "category": category,
+            "question": q["question"],
+            "pass": False,
+            "coverage": "0%",
+            "hits": [],
+            "missed": q["expected_concepts"],
+            "error": str(e)
+        }
+
 @app.route("/eval/run", methods=["POST"])
 def run_evaluation():
-    """Run evaluation on all or selected questions"""
+    """Run evaluation on all or selected questions.
+    Questions run concurrently (`concurrency`, default 8). Agent runs start
+    in a burst of up to `concurrency`, then at `qps` per second (default 1),
+    to stay within Vertex quotas. Answers are cached for a day; pass `fresh`
+    to rerun."""
     data = request.json or {}
-    categories = data.get("categories", list(EVAL_QUESTIONS.keys()))
-    delay = data.get("delay", 3)
-    
+    categories = [c for c in dict.fromkeys(data.get("categories", list(EVAL_QUESTIONS.keys())))
+                  if c in EVAL_QUESTIONS]
+    try:
+        concurrency = max(1, int(data.get("concurrency", 8)))
+        qps = float(data.get("qps", 1.0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency must be an integer and qps a number"}), 400
+    if not qps > 0:
+        return jsonify({"error": "qps must be positive"}), 400
+    limiter = _RateLimiter(qps, concurrency)
+
+    fresh = bool(data.get("fresh", False))
+
+    tasks = [(category, q) for category in categories for q in EVAL_QUESTIONS[category]]
+
+    def run(task):
+        return _eval_row(*task, fresh=fresh, limiter=limiter)
+
     all_rows = []
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(tasks))) as ex:
+            all_rows = list(ex.map(run, tasks))
+
     category_summary = {}
-    
     for category in categories:
-        if category not in EVAL_QUESTIONS:
-            continue
         questions = EVAL_QUESTIONS[category]
-        cat_passed = 0
-        
-        for q in questions:
-            try:
-                result = run_neuro_agent(q["question"])
-                answer = result.get("answer", "")
-                score = _score_answer(answer, q["expected_concepts"])
-                if score["pass"]:
-                    cat_passed += 1
-                all_rows.append({
-                    "id": q["id"],
-                    "category": category,
-                    "question": q["question"],
-                    "pass": score["pass"],
-                    "coverage": f"{score['coverage']*100:.0f}%",
-                    "hits": score["hits"],
-                    "missed": score["missed"],
-                    "gap": q.get("gap", ""),
-                    "answer_preview": answer[:500] if answer else ""
-                })
-            except Exception as e:
-                all_rows.append({
-                    "id": q["id"],
-                    "category": category,
-                    "question": q["question"],
-                    "pass": False,
-                    "coverage": "0%",
-                    "hits": [],
-                    "missed": q["expected_concepts"],
-                    "error": str(e)
-                })
-            time.sleep(delay)
-        
+        cat_passed = sum(1 for r in all_rows if r["category"] == category and r["pass"])
         pct = (cat_passed / len(questions) * 100) if questions else 0
         category_summary[category] = {
             "passed": cat_passed,
@@ -501,7 +1137,7 @@ def run_single_eval():
         for q in questions:
             if q["id"] == question_id:
                 try:
-                    result = run_neuro_agent(q["question"])
+                    result = _cached_agent_run(q["question"], bool(data.get("fresh", False)))
                     answer = result.get("answer", "")
                     score = _score_answer(answer, q["expected_concepts"])
                     return jsonify({
@@ -23,7 +23,7 @@ function toggleTrace() {
   document.getElementById('traceArrow').innerHTML = traceOpen ? '&#9660;' : '&#9654;';
 }
 
-async function submitQuery() {
+function submitQuery() {
   const q = document.getElementById('question').value.trim();
   if (!q) return;
 
@@ -35,80 +35,76 @@ async function submitQuery() {
   document.getElementById('loadingText').textContent = 'Searching...';
   document.getElementById('submitBtn').disabled = true;
 
-  const hopMessages = [
-    'Expanding query...',
-    'Searching vector index...',
-    'Retrieving documents...',
-    'Generating answer...',
-  ];
-  let hopIdx = 0;
-  const hopInterval = setInterval(() => {
-    if (hopIdx < hopMessages.length) {
+  const finish = () => {
+    source.close();
+    document.getElementById('loading').classList.remove('active');
+    document.getElementById('submitBtn').disabled = false;
+  };
+
+  // Each tool call is pushed by the server as it happens; the last message
+  // carries the full answer.
+  const source = new EventSource('/query/stream?question=' + encodeURIComponent(q));
+  source.onmessage = (msg) => {
+    const data = JSON.parse(msg.data);
+    if (data.type === 'hop') {
       const entry = document.createElement('div');
       entry.className = 'hop-entry';
-      entry.textContent = hopMessages[hopIdx++];
+      entry.textContent = `Step ${data.hop} - ${data.tool}(${Object.values(data.args).join(', ')})`;
       document.getElementById('hopLog').appendChild(entry);
       document.getElementById('loadingText').textContent = 'Processing...';
+      return;
     }
-  }, 2500);
-
-  try {
-    const res = await fetch('/query', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ question: q })
-    });
-    clearInterval(hopInterval);
-    const data = await res.json();
-
-    if (data.error) {
+    finish();
+    if (data.type === 'error') {
       document.getElementById('errorCard').textContent = data.error;
       document.getElementById('errorCard').classList.add('active');
     } else {
-      document.getElementById('resultBody').textContent = data.answer;
-      document.getElementById('hopCount').textContent = `${data.hops} step${data.hops !== 1 ? 's' : ''}`;
-
-      const dot = document.getElementById('statusDot');
-      const text = document.getElementById('statusText');
-      if (data.low_confidence) {
-        dot.className = 'status-dot warn';
-        text.textContent = 'Low confidence';
-      } else {
-        dot.className = 'status-dot';
-        text.textContent = 'Answer';
-      }
-
-      const traceEntries = document.getElementById('traceEntries');
-      traceEntries.innerHTML = '';
-      if (data.trace && data.trace.length > 0) {
-        data.trace.forEach(t => {
-          const div = document.createElement('div');
-          div.className = 'trace-hop';
-          div.innerHTML = `
-            <div class="trace-hop-header">Step ${t.hop} - ${t.tool}</div>
-            <div class="trace-hop-body">
-              Args: ${JSON.stringify(t.args)}<br>
-              Result: ${t.result_summary}
-            </div>`;
-          traceEntries.appendChild(div);
-        });
-        document.getElementById('traceSection').classList.add('active');
-      }
-
-      if (data.cited_papers && data.cited_papers.length > 0) {
-        renderCitedPapers(data.cited_papers);
-      }
-
-      document.getElementById('resultCard').classList.add('active');
+      renderResult(data);
     }
-  } catch (e) {
-    clearInterval(hopInterval);
-    document.getElementById('errorCard').textContent = 'Request failed: ' + e.message;
+  };
+  source.onerror = () => {
+    finish();
+    document.getElementById('errorCard').textContent = 'Request failed: connection lost';
     document.getElementById('errorCard').classList.add('active');
+  };
+}
+
+function renderResult(data) {
+  document.getElementById('resultBody').textContent = data.answer;
+  document.getElementById('hopCount').textContent = `${data.hops} step${data.hops !== 1 ? 's' : ''}`;
+
+  const dot = document.getElementById('statusDot');
+  const text = document.getElementById('statusText');
+  if (data.low_confidence) {
+    dot.className = 'status-dot warn';
+    text.textContent = 'Low confidence';
+  } else {
+    dot.className = 'status-dot';
+    text.textContent = 'Answer';
+  }
+
+  const traceEntries = document.getElementById('traceEntries');
+  traceEntries.innerHTML = '';
+  if (data.trace && data.trace.length > 0) {
+    data.trace.forEach(t => {
+      const div = document.createElement('div');
+      div.className = 'trace-hop';
+      div.innerHTML = `
+        <div class="trace-hop-header">Step ${t.hop} - ${t.tool}</div>
+        <div class="trace-hop-body">
+          Args: ${JSON.stringify(t.args)}<br>
+          Result: ${t.result_summary}
+        </div>`;
+      traceEntries.appendChild(div);
+    });
+    document.getElementById('traceSection').classList.add('active');
+  }
+
+  if (data.cited_papers && data.cited_papers.length > 0) {
+    renderCitedPapers(data.cited_papers);
   }
 
-  document.getElementById('loading').classList.remove('active');
-  document.getElementById('submitBtn').disabled = false;
+  document.getElementById('resultCard').classList.add('active');
 }
 
 function renderCitedPapers(papers) {